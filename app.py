@@ -1,7 +1,27 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
 import streamlit as st
 import io
 
+# The C parser's default NA strings, so the Arrow reader yields the same NaN cells
+C_PARSER_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# Mapping-file header rules: first substring found in the normalized (lowercase, no spaces) header wins
+HEADER_RENAME_RULES = (
+    ("glaccount", "GL Account"), ("etc", "EXTC"), ("extc", "EXTC"), ("mainaccount", "MainAccount"),
+    ("accounttype", "AccountType"), ("dtv_main_account", "DTV_Main_Account"), ("dtv_sub_account", "DTV_Sub_Account"),
+    ("att_company", "ATT_Company"), ("dtv_company", "DTV_Company"), ("dtv_cost_center", "DTV_Cost_Center"),
+    ("rcc", "RCC"), ("rco", "RCO"),
+)
+
+# Mapping-file name buckets: more specific substrings first ("ma" would also match e.g. "mam" or "company_mapping")
+MAPPING_FILE_BUCKETS = (("sam", "sam_df"), ("mam", "mam_df"), ("ccm", "ccm_df"), ("company", "company_df"), ("ma", "ma_df"))
+
 def main():
     st.set_page_config(page_title="GLSource File to Subledger Journals validation", layout="wide")
     st.title("📊 DTV Subledger to EDMCS mapping validator")
@@ -26,30 +46,39 @@ def main():
         col_rename = {}
         for col in df.columns:
             col_low = col.lower().replace(" ", "")
-            if 'glaccount' in col_low: col_rename[col] = 'GL Account'
-            elif 'etc' in col_low or 'extc' in col_low: col_rename[col] = 'EXTC'
-            elif 'mainaccount' in col_low: col_rename[col] = 'MainAccount'
-            elif 'accounttype' in col_low: col_rename[col] = 'AccountType'
-            elif 'dtv_main_account' in col_low: col_rename[col] = 'DTV_Main_Account'
-            elif 'dtv_sub_account' in col_low: col_rename[col] = 'DTV_Sub_Account'
-            elif 'att_company' in col_low: col_rename[col] = 'ATT_Company'
-            elif 'dtv_company' in col_low: col_rename[col] = 'DTV_Company'
-            elif 'dtv_cost_center' in col_low: col_rename[col] = 'DTV_Cost_Center'
-            elif 'rcc' in col_low: col_rename[col] = 'RCC'
-            elif 'rco' in col_low: col_rename[col] = 'RCO'
+            for key, target in HEADER_RENAME_RULES:
+                if key in col_low:
+                    col_rename[col] = target
+                    break
         if col_rename:
             df.rename(columns=col_rename, inplace=True)
         return df
 
-    def clean_str(val):
-        if pd.isna(val) or val == "":
-            return ""
-        return str(val).strip().upper()
+    def clean_series(s):
+        return s.fillna("").astype(str).str.strip().str.upper()
+
+    def read_csv_as_text(f, sep=","):
+    # Arrow infers column types ("000123" -> 123) before pandas' dtype=str applies, so pin every column to string
+        header = pd.read_csv(f, sep=sep, nrows=0).columns
+        f.seek(0)
+        table = pv.read_csv(
+            f,
+            parse_options=pv.ParseOptions(delimiter=sep),
+            convert_options=pv.ConvertOptions(column_types={name: pa.string() for name in header},
+                                           null_values=C_PARSER_NA_VALUES, strings_can_be_null=True))
+        text_df = table.to_pandas()
+    # Arrow nulls arrive as None; make them NaN like the C parser so astype(str) downstream still yields "nan"
+        return text_df.where(text_df.notna())
 
 # ---------- Extraction ----------
     def extract_data(csv_file, mapping_files):
     # Read CSV
-        df = pd.read_csv(csv_file, dtype=str, low_memory=False)
+        try:
+            df = read_csv_as_text(csv_file)
+        except Exception:
+        # fallback to the C parser (e.g. ragged rows the Arrow reader rejects)
+            csv_file.seek(0)
+            df = pd.read_csv(csv_file, dtype=str, low_memory=False)
         df.columns = df.columns.str.strip()
 
     # positional 19 columns mapping (index -> column name)
@@ -72,7 +101,7 @@ def main():
 
     # Only keep DTL rows (if Record Type exists)
         if "Record Type" in core_df.columns:
-            core_df = core_df[core_df["Record Type"].str.strip() == "DTL"].copy()
+            core_df = core_df[core_df["Record Type"] == "DTL"].copy()
         else:
             core_df["Record Type"] = "DTL"
 
@@ -80,34 +109,51 @@ def main():
         core_df["Amount"] = pd.to_numeric(core_df.get("Amount", "0").replace("", 0), errors="coerce").fillna(0)
 
     # Load mapping text files (pipe-delimited) and normalize headers
-        sam_df = mam_df = ma_df = company_df = ccm_df = None
+        frames = dict.fromkeys(slot for _, slot in MAPPING_FILE_BUCKETS)
         for f in mapping_files:
             try:
-                temp_df = pd.read_csv(f, sep="|", dtype=str, low_memory=False)
+                temp_df = read_csv_as_text(f, sep="|")
             except Exception:
-            # fallback attempt without sep param
-                temp_df = pd.read_csv(f, dtype=str, low_memory=False)
+            # fallback attempt with the C parser, then without sep param
+                f.seek(0)
+                try:
+                    temp_df = pd.read_csv(f, sep="|", dtype=str, low_memory=False)
+                except Exception:
+                    f.seek(0)
+                    temp_df = pd.read_csv(f, dtype=str, low_memory=False)
             temp_df = normalize_mapping_headers(temp_df)
             for c in temp_df.columns:
                 temp_df[c] = temp_df[c].astype(str).str.strip()
+        # precompute lookup keys once (columns are already stripped above; '*' wildcard survives upper())
+            if "GL Account" in temp_df.columns and "EXTC" in temp_df.columns:
+                temp_df["GL_CLEAN"] = temp_df["GL Account"].str.upper()
+                temp_df["EXTC_CLEAN"] = temp_df["EXTC"].str.upper()
+            if "MainAccount" in temp_df.columns:
+                temp_df["MAIN_CLEAN"] = temp_df["MainAccount"].str.upper()
+            if "ATT_Company" in temp_df.columns:
+                temp_df["COMP_CLEAN"] = temp_df["ATT_Company"].str.upper()
             fname = f.name.lower()
-            if "sam" in fname: sam_df = temp_df
-            elif "mam" in fname: mam_df = temp_df
-            elif "ma" in fname: ma_df = temp_df
-            elif "company" in fname: company_df = temp_df
-            elif "ccm" in fname: ccm_df = temp_df
+            for key, slot in MAPPING_FILE_BUCKETS:
+                if key in fname:
+                    frames[slot] = temp_df
+                    break
             else:
                 st.info(f"Skipped mapping file (unrecognized name): {f.name}")
 
-        if any(m is None for m in [sam_df, mam_df, ma_df, company_df, ccm_df]):
+        if any(m is None for m in frames.values()):
             raise ValueError("Missing one or more mapping files: sam, mam, ma, company, ccm")
 
-        return core_df, sam_df, mam_df, ma_df, company_df, ccm_df
+        return core_df, frames["sam_df"], frames["mam_df"], frames["ma_df"], frames["company_df"], frames["ccm_df"]
 
 # ---------- Load product mapping Excel ----------
     def load_product_mapping(product_file, sheet_name="DTV_BDS_UB_PRODUCT_MAPPING"):
     # Read the specified sheet
-        prod_df = pd.read_excel(product_file, sheet_name=sheet_name, dtype=str)
+        try:
+            prod_df = pd.read_excel(product_file, sheet_name=sheet_name, dtype=str, engine="calamine")
+        except ImportError:
+        # python-calamine not installed -> default (openpyxl) engine
+            product_file.seek(0)
+            prod_df = pd.read_excel(product_file, sheet_name=sheet_name, dtype=str)
         prod_df.columns = prod_df.columns.str.strip()
     # enforce the expected columns exist
         if "ATT_SLS_PRD_ID" not in prod_df.columns or "FIN_PRD_CD" not in prod_df.columns:
@@ -120,68 +166,68 @@ def main():
         return prod_df
 
 # ---------- Mapping helper ----------
-    def map_with_wildcard_clean(df, mapping_df, df_gl_col, df_extc_col, map_col_name, default_val="000000"):
-        df_gl = df[df_gl_col].apply(clean_str)
-        df_extc = df[df_extc_col].apply(clean_str)
-        mapping_df = mapping_df.copy()
-        mapping_df["GL_CLEAN"] = mapping_df["GL Account"].apply(clean_str)
-        mapping_df["EXTC_CLEAN"] = mapping_df["EXTC"].apply(lambda x: "*" if str(x).strip() == "*" else clean_str(x))
-        mapped = []
-        for gl_val, etc_val in zip(df_gl, df_extc):
-            match = mapping_df[(mapping_df["GL_CLEAN"] == gl_val) & (mapping_df["EXTC_CLEAN"] == etc_val)]
-            if match.empty:
-                match = mapping_df[(mapping_df["GL_CLEAN"] == gl_val) & (mapping_df["EXTC_CLEAN"] == "*")]
-            mapped.append(match.iloc[0][map_col_name] if not match.empty else default_val)
-        return mapped
+    # df_gl_clean / df_extc_clean and mapping_df's GL_CLEAN / EXTC_CLEAN are expected to be cleaned already
+    def map_with_wildcard_clean(df_gl_clean, df_extc_clean, mapping_df, map_col_name, default_val="000000"):
+        keys = pd.DataFrame({"GL_CLEAN": df_gl_clean.to_numpy(), "EXTC_CLEAN": df_extc_clean.to_numpy()})
+    # Pass 1: exact GL + EXTC match (first mapping row wins, as before)
+        exact_lut = mapping_df[["GL_CLEAN", "EXTC_CLEAN", map_col_name]].drop_duplicates(["GL_CLEAN", "EXTC_CLEAN"])
+        exact = keys.merge(exact_lut, how="left", on=["GL_CLEAN", "EXTC_CLEAN"])
+    # Pass 2: GL + wildcard EXTC ('*') for rows without an exact match
+        wild_lut = mapping_df.loc[mapping_df["EXTC_CLEAN"] == "*", ["GL_CLEAN", map_col_name]].drop_duplicates("GL_CLEAN")
+        wild = keys.merge(wild_lut.rename(columns={map_col_name: "_w"}), how="left", on="GL_CLEAN")
+        return exact[map_col_name].fillna(wild["_w"]).fillna(default_val).to_numpy()
 
 # ---------- Transformation ----------
     def transform_data(df, sam_df, mam_df, ma_df, company_df, ccm_df, product_df):
     # Clean & prepare keys
-        df["GL_CLEAN"] = df.get("GL Account (GLA)", "").apply(clean_str)
-        df["EXTC_CLEAN"] = df.get("EXTC", "").apply(clean_str)
-        df["COMP_CLEAN"] = df.get("Company Code", "").apply(clean_str)
-        df["RCC"] = df.get("RCC", "").astype(str).str.strip()
-        df["RCO"] = df.get("RCO", "").astype(str).str.strip()
+        df["GL_CLEAN"] = clean_series(df.get("GL Account (GLA)", ""))
+        df["EXTC_CLEAN"] = clean_series(df.get("EXTC", ""))
+        df["COMP_CLEAN"] = clean_series(df.get("Company Code", ""))
 
     # Map main/sub accounts
-        df["DTV_Main_Account"] = map_with_wildcard_clean(df, mam_df, "GL_CLEAN", "EXTC_CLEAN", "DTV_Main_Account")
-        df["DTV_Sub_Account"] = map_with_wildcard_clean(df, sam_df, "GL_CLEAN", "EXTC_CLEAN", "DTV_Sub_Account")
+        df["DTV_Main_Account"] = map_with_wildcard_clean(df["GL_CLEAN"], df["EXTC_CLEAN"], mam_df, "DTV_Main_Account")
+        df["DTV_Sub_Account"] = map_with_wildcard_clean(df["GL_CLEAN"], df["EXTC_CLEAN"], sam_df, "DTV_Sub_Account")
 
     # AccountType
-        ma_map_full = dict(zip(ma_df["MainAccount"].apply(clean_str), ma_df["AccountType"]))
-        df["AccountType_Code"] = df["DTV_Main_Account"].apply(clean_str).map(ma_map_full).fillna("UNKNOWN")
+        ma_lut = pd.Series(ma_df["AccountType"].to_numpy(), index=ma_df["MAIN_CLEAN"])
+        ma_lut = ma_lut[~ma_lut.index.duplicated(keep="last")]
+        df["AccountType_Code"] = clean_series(df["DTV_Main_Account"]).map(ma_lut).fillna("UNKNOWN")
         df["AccountType"] = df["AccountType_Code"].map(ACCOUNT_TYPE_MAP).fillna(df["AccountType_Code"])
 
     # Company mapping
-        company_map = dict(zip(company_df["ATT_Company"].apply(clean_str), company_df["DTV_Company"]))
-        df["DTV_Company"] = df["COMP_CLEAN"].map(company_map).fillna("NULL")
+        company_lut = pd.Series(company_df["DTV_Company"].to_numpy(), index=company_df["COMP_CLEAN"])
+        company_lut = company_lut[~company_lut.index.duplicated(keep="last")]
+        df["DTV_Company"] = df["COMP_CLEAN"].map(company_lut).fillna("NULL")
 
     # Cost center mapping
-        ccm_key = ccm_df["RCC"].astype(str).str.strip() + "|" + ccm_df["AccountType"].astype(str).str.strip()
-        ccm_map = dict(zip(ccm_key, ccm_df["DTV_Cost_Center"]))
-        cost_key = df["RCC"].astype(str).str.strip() + "|" + df["AccountType_Code"].astype(str).str.strip()
-        df["DTV_Cost_Center"] = cost_key.map(ccm_map).fillna("000000")
+        ccm_small = ccm_df[["RCC", "AccountType", "DTV_Cost_Center"]].drop_duplicates(["RCC", "AccountType"], keep="last")
+        cost = df[["RCC", "AccountType_Code"]].merge(
+            ccm_small, how="left", left_on=["RCC", "AccountType_Code"], right_on=["RCC", "AccountType"])
+        df["DTV_Cost_Center"] = cost["DTV_Cost_Center"].fillna("000000").to_numpy()
 
     # ---------------- Product mapping using product_df (sheet: DTV_BDS_UB_PRODUCT_MAPPING) ----------------
-    # Clean Product Code and mapping keys (case-insensitive & strip)
-        df["Product Code"] = df.get("Product Code", "").astype(str).str.strip().str.upper()
+    # Upper-case Product Code (already stripped at extraction) and store as category for the lookup
+        df["Product Code"] = df["Product Code"].str.upper().astype("category")
         product_df = product_df = product_df = product_df  # no-op to indicate usage (keeps linter happy)
 
-    # product_df already cleaned by loader, create mapping dict
-        prod_map = dict(zip(product_df["ATT_SLS_PRD_ID"], product_df["FIN_PRD_CD"]))
+    # product_df already cleaned and de-duplicated by loader -> index it by product id
+        prod_lut = product_df.set_index("ATT_SLS_PRD_ID")["FIN_PRD_CD"]
 
     # Map to FIN_PRD_CD; do not fill with 0000 here so we can detect unmatched explicitly
-        df["FIN_PRD_CD"] = df["Product Code"].map(prod_map)
+    # (category Product Code: only the distinct codes are looked up)
+        df["FIN_PRD_CD"] = df["Product Code"].map(prod_lut)
 
     # Create final Product column (will be used in Account)
     # If FIN_PRD_CD missing/NaN -> set "0000"
-        df["Product"] = df["FIN_PRD_CD"].fillna("0000").replace(["", "UNMATCHED", "MISSING"], "0000")
-        df["Product"] = df["Product"].fillna("0000")
+        fin = df["FIN_PRD_CD"].to_numpy(dtype=object)
+        bad = pd.isna(fin) | np.isin(fin, ["", "UNMATCHED", "MISSING"])
+        df["Product"] = np.where(bad, "0000", fin)
 
     # Debit/Credit
-        df["Debit"] = df["Amount"].apply(lambda x: round(x, 2) if x > 0 else 0)
-        df["Credit"] = df["Amount"].apply(lambda x: round(abs(x), 2) if x < 0 else 0)
         df["Amount"] = df["Amount"].round(2)
+        amt = df["Amount"].to_numpy()
+        df["Debit"] = np.where(amt > 0, amt, 0.0)
+        df["Credit"] = np.where(amt < 0, -amt, 0.0)
 
     # Defaults
         df["Intercompany"] = "0000"
@@ -190,17 +236,10 @@ def main():
         df["Reserved2"] = "00000"
 
     # Build Account using final Product (mapped FIN_PRD_CD or "0000")
-        df["Account"] = (
-            df["DTV_Company"] + "*" +
-            df["DTV_Main_Account"] + "*" +
-            df["DTV_Sub_Account"] + "*" +
-            df["DTV_Cost_Center"] + "*" +
-            df["Intercompany"] + "*" +
-            df["Product"] + "*" +
-            df["TaxJurisdiction"] + "*" +
-            df["Reserved1"] + "*" +
-            df["Reserved2"]
-        )
+        account_cols = ["DTV_Company", "DTV_Main_Account", "DTV_Sub_Account", "DTV_Cost_Center", "Intercompany",
+                        "Product", "TaxJurisdiction", "Reserved1", "Reserved2"]
+        cols = [df[c].to_numpy() for c in account_cols]
+        df["Account"] = ["*".join(t) for t in zip(*cols)]
 
     # Unmatched: main/sub/company or product mapping missing
         unmatched = df[
@@ -210,39 +249,44 @@ def main():
             (df["FIN_PRD_CD"].isna())  # product mapping didn't find
         ].copy()
 
+    # Summary keys have a small vocabulary -> category, so the groupby hashes integer codes
+        group_cols = ["DTV_Company", "DTV_Main_Account", "AccountType", "DTV_Sub_Account", "DTV_Cost_Center", "FIN_PRD_CD"]
+        for c in group_cols:
+            df[c] = df[c].astype("category")
+
     # Summary aggregation
         summary = df.groupby(
-            ["DTV_Company", "DTV_Main_Account", "AccountType", "DTV_Sub_Account", "DTV_Cost_Center", "FIN_PRD_CD"],
-            dropna=False, as_index=False
+            group_cols,
+            dropna=False, as_index=False, observed=True, sort=False
             ).agg({"Debit": "sum", "Credit": "sum"})
 
         summary["Debit"] = summary["Debit"].round(2)
         summary["Credit"] = summary["Credit"].round(2)
 
-        summary["Account"] = (
-            summary["DTV_Company"] + "*" +
-            summary["DTV_Main_Account"] + "*" +
-            summary["DTV_Sub_Account"] + "*" +
-            summary["AccountType"] + "*" +
-            summary["DTV_Cost_Center"] + "*0000*" +
-            summary["FIN_PRD_CD"] + "*000*00000*00000"
-        )
+        summary_cols = ["DTV_Company", "DTV_Main_Account", "DTV_Sub_Account", "AccountType", "DTV_Cost_Center"]
+        cols = [summary[c].to_numpy(dtype=str) for c in summary_cols]
+        cols += [np.full(len(summary), "0000"), summary["FIN_PRD_CD"].to_numpy(dtype=str),
+                 np.full(len(summary), "000"), np.full(len(summary), "00000"), np.full(len(summary), "00000")]
+        summary["Account"] = ["*".join(t) for t in zip(*cols)]
+    # unmapped product (NaN FIN_PRD_CD) keeps an empty Account, as with the old string concat
+        summary["Account"] = summary["Account"].where(summary["FIN_PRD_CD"].notna())
 
 
         return df, summary, unmatched
 
 # ---------- Prepare rows for grouped summary download ----------
     def prepare_debit_credit_rows(summary):
-        rows = []
-        for _, row in summary.iterrows():
-            base = row.to_dict()
-            if row["Debit"] != 0:
-                r = base.copy(); r["Debit"] = f"{row['Debit']:.2f}"; r["Credit"] = ""
-                rows.append(r)
-            if row["Credit"] != 0:
-                r = base.copy(); r["Debit"] = ""; r["Credit"] = f"{row['Credit']:.2f}"
-                rows.append(r)
-        return pd.DataFrame(rows)
+        deb = summary[summary["Debit"] != 0].copy()
+        deb["Debit"] = deb["Debit"].map("{:.2f}".format); deb["Credit"] = ""
+        cre = summary[summary["Credit"] != 0].copy()
+        cre["Credit"] = cre["Credit"].map("{:.2f}".format); cre["Debit"] = ""
+    # stable sort on the summary index keeps each group's debit row ahead of its credit row
+        return pd.concat([deb, cre]).sort_index(kind="stable").reset_index(drop=True)
+
+# ---------- CSV bytes for download buttons ----------
+    def to_csv_bytes(frame):
+        buf = io.BytesIO(); frame.to_csv(buf, index=False, encoding="utf-8")
+        return buf.getvalue()
 
 # ---------- UI: show results ----------
     def load_summary(df, summary, unmatched):
@@ -259,19 +303,18 @@ def main():
             melted = prepare_debit_credit_rows(summary)
             totals_row = {**{c: "" for c in melted.columns}, "DTV_Company": "TOTAL",
                         "Debit": f"{total_debit:.2f}", "Credit": f"{total_credit:.2f}"}
-            melted = pd.concat([melted, pd.DataFrame([totals_row])], ignore_index=True)
+            totals_df = pd.DataFrame([totals_row])
+            melted = totals_df if melted.empty else pd.concat([melted, totals_df], ignore_index=True, copy=False)
             st.dataframe(melted, use_container_width=True)
-            buf = io.StringIO(); melted.to_csv(buf, index=False)
-            st.download_button("💾 Download Grouped Summary", buf.getvalue(), "Grouped_Summary.csv", "text/csv")
+            st.download_button("💾 Download Grouped Summary", to_csv_bytes(melted), "Grouped_Summary.csv", "text/csv")
 
         with tab2:
         # show relevant columns but ensure user sees mapped value
-            display_df = df.copy()
+            display_df = df.copy(deep=False)
         # ensure visible Product Code column shows the mapped value (rename Product -> Product Code)
             display_df["Product Code (Mapped)"] = display_df["Product"]
             st.dataframe(display_df, use_container_width=True)
-            buf = io.StringIO(); display_df.to_csv(buf, index=False)
-            st.download_button("💾 Download Detailed DTL", buf.getvalue(), "Detailed_DTL.csv", "text/csv")
+            st.download_button("💾 Download Detailed DTL", to_csv_bytes(display_df), "Detailed_DTL.csv", "text/csv")
 
         with tab3:
             if unmatched.empty:
@@ -282,8 +325,7 @@ def main():
                 show_cols = ["Product Code", "FIN_PRD_CD", "Product", "DTV_Company", "DTV_Main_Account", "DTV_Sub_Account", "Amount"]
                 cols_to_show = [c for c in show_cols if c in unmatched.columns]
                 st.dataframe(unmatched[cols_to_show], use_container_width=True)
-                buf = io.StringIO(); unmatched[cols_to_show].to_csv(buf, index=False)
-                st.download_button("💾 Download Unmatched Records", buf.getvalue(), "Unmatched_Records.csv", "text/csv")
+                st.download_button("💾 Download Unmatched Records", to_csv_bytes(unmatched[cols_to_show]), "Unmatched_Records.csv", "text/csv")
 
 # ---------- Streamlit file upload controls ----------
     csv_file = st.file_uploader("Upload Transaction CSV", type=["csv"])